@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    Un cubo de tokens por clave (sid o IP): se recargan rate tokens por
+    segundo hasta burst. Cada clave ocupa una lista [tokens, última_recarga]
+    y, al superar max_keys, se expulsan las menos usadas recientemente.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1.0):
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+    def forget(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class DuplicateFilter:
+    """Detecta reenvíos idénticos del mismo sid dentro de window segundos."""
+
+    def __init__(self, window=2.0, max_keys=10000, clock=time.monotonic):
+        self.window = window
+        self.max_keys = max_keys
+        self._clock = clock
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, key, text):
+        now = self._clock()
+        with self._lock:
+            previous = self._last.get(key)
+            self._last[key] = (text, now)
+            self._last.move_to_end(key)
+            if len(self._last) > self.max_keys:
+                self._last.popitem(last=False)
+        return previous is not None and previous[0] == text and now - previous[1] < self.window
+
+    def forget(self, key):
+        with self._lock:
+            self._last.pop(key, None)
+
+
+class InflightLimiter:
+    """Tope global de llamadas simultáneas al LLM; no espera, solo acepta o rechaza."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.inflight >= self.limit:
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+
+
+def truncate_input(text, max_chars):
+    """Recorta el mensaje del usuario antes de interpolarlo en el prompt."""
+    return text[:max_chars].rstrip() if len(text) > max_chars else text
@@ -1,13 +1,35 @@
-from flask import Flask, render_template, request, session
-from flask_socketio import SocketIO
-import sqlite3
 import os
 from dotenv import load_dotenv
-from groq import Groq
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Con eventlet hay que parchear la librería estándar antes de importar nada más,
+# para que las llamadas HTTP a Groq cedan el control en lugar de bloquear el bucle.
+ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'eventlet')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, Response, abort, render_template, request, stream_with_context
+from flask_socketio import SocketIO
+import atexit
+from datetime import datetime
+import hmac
+import json
+import time
+import uuid
+import groq
+from groq import Groq
+from llm_dispatch import LLMDispatcher, call_with_retry
+from cache import CompletionCache, normalize_prompt, to_cacheable, from_placeholders
+from db import db_pool, init_db, insert_leads, LeadWriter
+from store import ConversationState, create_conversation_store
+from replies import ReplyEngine, StreamAbandoned, parse_budgets
+from export import FORMATS, iter_leads
+import metrics
+from admission import DuplicateFilter, InflightLimiter, TokenBucketLimiter, truncate_input
+
 # Configuración Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'super_secret_key')
@@ -17,7 +39,14 @@ socketio = SocketIO(app, cors_allowed_origins=[
     'http://127.0.0.1:5000',
     'http://localhost:5000',
     'https://kaisa-chatbot.onrender.com'
-], async_mode='eventlet')
+], async_mode=ASYNC_MODE, message_queue=os.getenv('SOCKETIO_MESSAGE_QUEUE'))
+
+# Estado de las conversaciones fuera de la sesión del proceso, para poder
+# repartir la carga entre varios procesos (p. ej. CONVERSATION_STORE=sqlite:///conversations.db)
+conversation_store = create_conversation_store(
+    os.getenv('CONVERSATION_STORE', 'memory'),
+    idle_ttl=float(os.getenv('CONVERSATION_IDLE_TTL', '1800'))
+)
 
 # Inicializar cliente Groq
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
@@ -25,54 +54,86 @@ if not GROQ_API_KEY:
     print("Error: La variable de entorno GROQ_API_KEY no está configurada.")
     groq_client = None
 else:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+    # Los reintentos los gestiona call_with_retry para respetar el plazo total
+    groq_client = Groq(api_key=GROQ_API_KEY, max_retries=0)
 
-DATABASE_URL = os.getenv('DATABASE_URL')
+# Límites de las llamadas al LLM
+LLM_WORKERS = int(os.getenv('LLM_WORKERS', '8'))
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '20'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
 
-# Función para obtener una conexión a la base de datos
-def get_db_connection():
-    if DATABASE_URL:
-        import psycopg2
-        return psycopg2.connect(DATABASE_URL)
-    else:
-        return sqlite3.connect('leads.db')
-
-# Inicializar DB
-def init_db():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        if DATABASE_URL:
-            # Sintaxis para PostgreSQL
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS leads (
-                    id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    email TEXT NOT NULL,
-                    business_type TEXT,
-                    needs TEXT,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        else:
-            # Sintaxis para SQLite
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS leads (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    email TEXT NOT NULL,
-                    business_type TEXT,
-                    needs TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        conn.commit()
-        cursor.close()
+llm_dispatcher = LLMDispatcher(
+    spawn=socketio.start_background_task,
+    queue_factory=socketio.server.eio.create_queue,
+    workers=LLM_WORKERS,
+    max_queued=int(os.getenv('LLM_MAX_QUEUED', '200')),
+    # Una llamada tardía al LLM no dura más que LLM_DEADLINE desde que empezó
+    cancel_ttl=LLM_DEADLINE
+)
+
+# Control de admisión: límite de mensajes por sid y por IP, tope global de
+# llamadas simultáneas a Groq, longitud máxima del mensaje y reenvíos duplicados
+MAX_INPUT_CHARS = int(os.getenv('MAX_INPUT_CHARS', '500'))
+TRUST_PROXY_HEADERS = os.getenv('TRUST_PROXY_HEADERS', '0') == '1'
+# Sin cabeceras de proxy de confianza todos los usuarios comparten la IP del
+# proxy (p. ej. en Render), así que el límite por IP solo se activa con ellas
+# salvo que se fuerce con RATE_LIMIT_IP=1 (o se desactive con RATE_LIMIT_IP=0).
+RATE_LIMIT_IP = os.getenv('RATE_LIMIT_IP', '1' if TRUST_PROXY_HEADERS else '0') == '1'
+sid_limiter = TokenBucketLimiter(
+    rate=float(os.getenv('RATE_LIMIT_SID_RATE', '0.5')),
+    burst=float(os.getenv('RATE_LIMIT_SID_BURST', '5'))
+)
+ip_limiter = TokenBucketLimiter(
+    rate=float(os.getenv('RATE_LIMIT_IP_RATE', '2')),
+    burst=float(os.getenv('RATE_LIMIT_IP_BURST', '20'))
+)
+duplicate_filter = DuplicateFilter(window=float(os.getenv('DEDUP_WINDOW', '2')))
+llm_inflight = InflightLimiter(int(os.getenv('LLM_MAX_INFLIGHT', str(LLM_WORKERS * 2))))
+
+# Presupuesto de latencia por paso (REPLY_BUDGETS='0=3,2=4') y qué hacer con la
+# respuesta del LLM que llega tarde: 'drop' o 'followup'
+reply_engine = ReplyEngine(
+    spawn=socketio.start_background_task,
+    event_factory=socketio.server.eio.create_event,
+    budgets=parse_budgets(os.getenv('REPLY_BUDGETS')),
+    late_mode=os.getenv('REPLY_LATE_MODE', 'drop'),
+    deadline=LLM_DEADLINE
+)
+
+# Caché de respuestas (COMPLETION_CACHE_SIZE=0 la desactiva)
+completion_cache = CompletionCache(
+    max_entries=int(os.getenv('COMPLETION_CACHE_SIZE', '512')),
+    ttl=float(os.getenv('COMPLETION_CACHE_TTL', '3600')),
+    db_path=os.getenv('COMPLETION_CACHE_DB')
+)
+metrics.cache_stats.set_function(lambda: {(k,): v for k, v in completion_cache.stats().items()})
+metrics.llm_inflight.set_function(lambda: {('running',): llm_inflight.inflight, ('queued',): llm_dispatcher.queued()})
+
+# Registro JSON de cada turno en la salida estándar (METRICS_TURN_LOG=1)
+METRICS_TURN_LOG = os.getenv('METRICS_TURN_LOG', '0') == '1'
+if os.getenv('METRICS_LOOP_LAG', '1') == '1':
+    socketio.start_background_task(metrics.monitor_loop_lag, socketio.sleep)
+
+# Escritura diferida de leads (LEADS_WRITE_BEHIND=1): step_3 no espera a la base de datos
+LEADS_WRITE_BEHIND = os.getenv('LEADS_WRITE_BEHIND', '0') == '1'
+lead_writer = LeadWriter(
+    db_pool,
+    spawn=socketio.start_background_task,
+    event_factory=socketio.server.eio.create_event,
+    batch_size=int(os.getenv('LEADS_BATCH_SIZE', '50')),
+    interval=float(os.getenv('LEADS_FLUSH_INTERVAL', '2')),
+    spool_path=os.getenv('LEADS_SPOOL_PATH', 'leads_spool.jsonl')
+)
+if LEADS_WRITE_BEHIND:
+    lead_writer.start()
+    # Volcar lo pendiente al apagar el servidor para no perder leads
+    atexit.register(lead_writer.flush)
 
 # Inicializa la base de datos al iniciar la aplicación
 init_db()
 
-# Función para generar respuesta con Groq
-def generate_ai_response(state, user_message, step):
+# Construye el prompt completo para el paso actual
+def build_prompt(state, user_message, step):
     system_prompt = (
         "Eres Kaisa, una asistente digital amigable, profesional y con un toque de humor ligero. "
         "Tu objetivo es recopilar información de contacto del cliente (nombre, email, tipo de negocio, necesidades) "
@@ -88,20 +149,136 @@ def generate_ai_response(state, user_message, step):
     }
     instruction = prompts_by_step.get(step, "La conversación ha terminado. Agradece al usuario.")
 
-    full_prompt = f"{system_prompt}\n\n{history}\n\nTarea actual:\n{instruction}"
+    return f"{system_prompt}\n\n{history}\n\nTarea actual:\n{instruction}"
+
+# Respuestas de plantilla por paso, usadas cuando el LLM no responde dentro del presupuesto
+templates_by_step = {
+    0: "¡Encantada de conocerte, {name}! Soy Kaisa. ¿Me compartes tu correo electrónico?",
+    1: "¡Gracias! Ya tengo tu email. Cuéntame, ¿qué tipo de negocio tienes?",
+    2: "¡Genial! Para un negocio como el tuyo solemos recomendar: {recommendations}. ¿Qué necesitas o qué problemas quieres resolver con una página web?",
+    3: "¡Muchas gracias, {name}! Tus datos quedaron guardados y nuestro equipo se pondrá en contacto contigo pronto."
+}
+
+def template_reply(state, step):
+    template = templates_by_step.get(step, "¡Gracias por conversar conmigo!")
+    # Minúscula inicial para encajar en la frase, sin tocar siglas como SEO o CRM
+    recommendations = ', '.join(
+        rec[0].lower() + rec[1:] if rec[1:2].islower() else rec
+        for rec in get_recommendations(state.get('business_type') or '')
+    )
+    return template.format(name=state.get('name') or '', recommendations=recommendations)
+
+# Llamada a Groq; lanza una excepción si no se obtiene respuesta
+def llm_completion(full_prompt, on_chunk=None):
+    parts = []
 
+    def complete(timeout):
+        if on_chunk is None:
+            with metrics.groq_seconds.time('full'):
+                response = groq_client.chat.completions.create(
+                    messages=[{"role": "user", "content": full_prompt}],
+                    model="llama-3.3-70b-versatile",
+                    max_tokens=150,
+                    timeout=timeout
+                )
+            metrics.record_usage(response.usage)
+            return response.choices[0].message.content.strip()
+
+        # Modo streaming: reenviar cada fragmento y devolver el texto completo
+        with metrics.groq_seconds.time('stream'):
+            stream = groq_client.chat.completions.create(
+                messages=[{"role": "user", "content": full_prompt}],
+                model="llama-3.3-70b-versatile",
+                max_tokens=150,
+                stream=True,
+                timeout=timeout
+            )
+            # on_chunk lanza StreamAbandoned si el turno ya no necesita el texto;
+            # cerrar el stream libera la conexión HTTP con Groq.
+            try:
+                for chunk in stream:
+                    # Groq envía el consumo de tokens en el último fragmento (x_groq.usage)
+                    metrics.record_usage(getattr(getattr(chunk, 'x_groq', None), 'usage', None))
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        # Evitar espacios iniciales, igual que el .strip() del modo normal
+                        if not parts:
+                            delta = delta.lstrip()
+                            if not delta:
+                                continue
+                        parts.append(delta)
+                        on_chunk(delta)
+            finally:
+                stream.close()
+        return ''.join(parts).strip()
+
+    if not groq_client:
+        raise Exception("Cliente Groq no inicializado.")
+    # Las respuestas tardías siguen en curso tras enviar la plantilla, por eso
+    # el tope se aplica aquí y no solo en el número de trabajadores.
+    if not llm_inflight.try_acquire():
+        metrics.admission_rejected.inc(1, 'llm_inflight')
+        raise Exception("Demasiadas llamadas al LLM en curso.")
+    # Una vez enviados fragmentos al cliente no se reintenta, para no duplicar texto
     try:
-        if not groq_client:
-            raise Exception("Cliente Groq no inicializado.")
-        response = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": full_prompt}],
-            model="llama-3.3-70b-versatile",
-            max_tokens=150
+        return call_with_retry(
+            complete, LLM_DEADLINE,
+            lambda e: not parts and is_retryable_error(e),
+            max_retries=LLM_MAX_RETRIES,
+            sleep=socketio.sleep
         )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print("Error generando respuesta con Groq:", e)
-        return "Lo siento, tuve un problema generando la respuesta."
+    except StreamAbandoned:
+        raise
+    except Exception:
+        metrics.groq_errors.inc()
+        raise
+    finally:
+        llm_inflight.release()
+
+# Función para generar respuesta: caché, después LLM con plantilla de respaldo
+def generate_ai_response(state, user_message, step, on_chunk=None, sid=None):
+    full_prompt = build_prompt(state, user_message, step)
+
+    # El nombre y el email se guardan como marcadores para que la misma entrada
+    # sirva a cualquier usuario con un contexto equivalente.
+    personal = {'{{nombre}}': state.get('name'), '{{email}}': state.get('email')}
+    cache_key = completion_cache.make_key(step, normalize_prompt(full_prompt, personal))
+    cached = completion_cache.get(cache_key)
+    if cached is not None:
+        text = from_placeholders(cached, personal)
+        if on_chunk:
+            on_chunk(text)
+        return text
+
+    def generate(on_chunk):
+        text = llm_completion(full_prompt, on_chunk)
+        # Solo se cachea si no queda ningún dato personal sin sustituir
+        cacheable = to_cacheable(text, personal)
+        if cacheable is not None:
+            completion_cache.set(cache_key, cacheable)
+        return text
+
+    def on_late(text):
+        socketio.emit('message', {'text': text, 'followup': True}, to=sid)
+
+    template = template_reply(state, step)
+    text = reply_engine.reply(
+        step, template, generate,
+        on_chunk=on_chunk,
+        on_late=on_late if sid else None,
+        available=groq_client is not None,
+        # Si el usuario se desconecta, la llamada en curso (o tardía) se corta
+        cancelled=(lambda: llm_dispatcher.cancelled(sid)) if sid else None
+    )
+    if text is template:
+        metrics.template_replies.inc(1, step)
+    return text
+
+# Errores transitorios de Groq que merece la pena reintentar (429, 5xx, red)
+def is_retryable_error(e):
+    if isinstance(e, groq.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return isinstance(e, groq.APIConnectionError)
 
 # Recomendaciones iniciales
 def get_recommendations(business_type):
@@ -122,52 +299,83 @@ def index():
 def favicon():
     return '', 204
 
+# Métricas en formato de texto de Prometheus
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Exportación de leads para administración: Authorization: Bearer <ADMIN_TOKEN>
+# Parámetros opcionales: after_created_at y after_id para continuar desde un lead.
+@app.route('/admin/leads.<fmt>')
+def export_leads(fmt):
+    admin_token = os.getenv('ADMIN_TOKEN')
+    auth = request.headers.get('Authorization', '')
+    if not admin_token or not hmac.compare_digest(auth.encode(), f'Bearer {admin_token}'.encode()):
+        abort(401)
+    if fmt not in FORMATS:
+        abort(404)
+    after = None
+    after_created_at = request.args.get('after_created_at')
+    after_id = request.args.get('after_id')
+    if after_created_at or after_id:
+        # Un cursor mal formado compararía contra NULL y devolvería una página vacía
+        try:
+            datetime.fromisoformat(after_created_at or '')
+            after = (after_created_at, int(after_id or ''))
+        except ValueError:
+            abort(400)
+    mimetypes = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+    # Respuesta por fragmentos: los leads se leen y envían página a página
+    return Response(
+        stream_with_context(FORMATS[fmt](iter_leads(after=after))),
+        mimetype=mimetypes[fmt],
+        headers={'Content-Disposition': f'attachment; filename=leads.{fmt}'}
+    )
+
 # WebSocket
 @socketio.on('connect')
 def connect():
-    session['chat_state'] = {'step': 0, 'name': '', 'email': '', 'business_type': '', 'needs': ''}
-    session.modified = True
+    conversation_store.save(request.sid, ConversationState())
+    metrics.active_connections.inc()
+    metrics.funnel.inc(1, 0)
     socketio.emit('message', {'text': '¡Hola! Soy Kaisa, tu asistente digital. ¿Cuál es tu nombre?'}, to=request.sid)
 
 # Manejo de pasos
-def step_0(state, msg, sid):
+def step_0(state, msg, sid, on_chunk=None):
     state['name'] = msg
     state['step'] = 1
-    return generate_ai_response(state, msg, 0)
+    return generate_ai_response(state, msg, 0, on_chunk, sid)
 
-def step_1(state, msg, sid):
+def step_1(state, msg, sid, on_chunk=None):
     if '@' not in msg:
         socketio.emit('message', {'text': 'Ingresa un email válido, por favor.'}, to=sid)
         return None
     state['email'] = msg
     state['step'] = 2
-    return generate_ai_response(state, msg, 1)
+    return generate_ai_response(state, msg, 1, on_chunk, sid)
 
-def step_2(state, msg, sid):
+def step_2(state, msg, sid, on_chunk=None):
     state['business_type'] = msg
     state['step'] = 3
-    return generate_ai_response(state, msg, 2)
+    return generate_ai_response(state, msg, 2, on_chunk, sid)
 
-def step_3(state, msg, sid):
+def step_3(state, msg, sid, on_chunk=None):
     state['needs'] = msg
-    ai_resp = generate_ai_response(state, msg, 3)
+    ai_resp = generate_ai_response(state, msg, 3, on_chunk, sid)
     
-    try: 
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            # Usar %s para PostgreSQL y ? para SQLite
-            placeholder = '%s' if DATABASE_URL else '?'
-            sql = f'INSERT INTO leads (name, email, business_type, needs) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder})'
-            cursor.execute(sql, (state['name'], state['email'], state['business_type'], state['needs']))
-            conn.commit()
-            cursor.close()
-    except Exception as e:
-        print("Error guardando lead:", e)
-        ai_resp += "\n(Hubo un error guardando los datos, pero no te preocupes, lo revisaremos)."
+    lead = {'name': state['name'], 'email': state['email'], 'business_type': state['business_type'], 'needs': state['needs']}
+    if LEADS_WRITE_BEHIND:
+        lead_writer.enqueue(lead)
+    else:
+        try:
+            db_pool.run(lambda conn: insert_leads(conn, [lead]))
+        except Exception as e:
+            print("Error guardando lead:", e)
+            ai_resp += "\n(Hubo un error guardando los datos, pero no te preocupes, lo revisaremos)."
     state['step'] = 4
     return ai_resp
 
-def step_4(state, msg, sid):
+def step_4(state, msg, sid, on_chunk=None):
     return "¡Gracias! Hemos registrado tus datos. Nuestro equipo se pondrá en contacto contigo pronto."
 
 step_handlers = [step_0, step_1, step_2, step_3, step_4]
@@ -175,17 +383,76 @@ step_handlers = [step_0, step_1, step_2, step_3, step_4]
 @socketio.on('message')
 def handle_message(data):
     sid = request.sid
-    user_message = data.get('text','').strip()
-    state = session.get('chat_state', {'step':0})
+    user_message = truncate_input(data.get('text','').strip(), MAX_INPUT_CHARS)
+    # Los clientes que envían 'stream' reciben la respuesta por fragmentos;
+    # el resto sigue recibiendo un único evento 'message'.
+    stream = bool(data.get('stream'))
+
+    # Reenvíos idénticos seguidos (doble clic, reconexiones) se ignoran sin
+    # respuesta; si el turno original ya respondió, se avisa al cliente para que
+    # quite el indicador de escritura que añadió al enviar.
+    if duplicate_filter.is_duplicate(sid, user_message):
+        metrics.admission_rejected.inc(1, 'duplicate')
+        if not llm_dispatcher.busy(sid):
+            socketio.emit('typing_done', {}, to=sid)
+        return
+    if not sid_limiter.allow(sid) or (RATE_LIMIT_IP and not ip_limiter.allow(client_ip())):
+        metrics.admission_rejected.inc(1, 'rate_limit')
+        socketio.emit('message', {'text': 'Vas muy rápido 😅 Espera unos segundos y vuelve a escribirme.', 'busy': True}, to=sid)
+        return
+    # El turno se procesa fuera del manejador: el evento vuelve de inmediato y
+    # los mensajes de este sid se atienden en orden.
+    if not llm_dispatcher.submit(sid, run_turn, user_message, sid, stream):
+        metrics.admission_rejected.inc(1, 'queue_full')
+        socketio.emit('message', {'text': 'Ahora mismo estoy atendiendo muchas conversaciones. Inténtalo de nuevo en un momento, por favor.', 'busy': True}, to=sid)
+
+# IP del cliente; detrás de un proxy de confianza, la última entrada de X-Forwarded-For
+def client_ip():
+    forwarded = request.headers.get('X-Forwarded-For') if TRUST_PROXY_HEADERS else None
+    if forwarded:
+        return forwarded.split(',')[-1].strip()
+    return request.remote_addr
+
+@socketio.on('disconnect')
+def disconnect():
+    llm_dispatcher.cancel(request.sid)
+    conversation_store.delete(request.sid)
+    sid_limiter.forget(request.sid)
+    duplicate_filter.forget(request.sid)
+    metrics.active_connections.dec()
+
+# Ejecuta un turno completo de la conversación y emite la respuesta
+def run_turn(user_message, sid, stream):
+    state = conversation_store.load(sid) or ConversationState()
     step = state.get('step',0)
 
     if 0 <= step < len(step_handlers):
+        start = time.perf_counter()
         handler = step_handlers[step]
-        ai_resp = handler(state, user_message, sid)
-        session['chat_state'] = state
-        session.modified = True
+        msg_id = uuid.uuid4().hex if stream else None
+        on_chunk = None
+        if stream:
+            def on_chunk(delta):
+                socketio.emit('message_chunk', {'id': msg_id, 'text': delta}, to=sid)
+        ai_resp = handler(state, user_message, sid, on_chunk)
+        # Si el usuario se desconectó durante el turno, disconnect ya borró su
+        # estado: guardarlo ahora lo resucitaría hasta que caduque.
+        if llm_dispatcher.cancelled(sid):
+            return
+        conversation_store.save(sid, state)
+        if state['step'] != step:
+            metrics.funnel.inc(1, state['step'])
         if ai_resp:
-            socketio.emit('message', {'text': ai_resp}, to=sid)
+            if stream:
+                # El texto final reemplaza lo acumulado (p. ej. avisos añadidos en step_3)
+                socketio.emit('message_done', {'id': msg_id, 'text': ai_resp}, to=sid)
+            else:
+                socketio.emit('message', {'text': ai_resp}, to=sid)
+        elapsed = time.perf_counter() - start
+        metrics.turn_seconds.observe(elapsed, step)
+        if METRICS_TURN_LOG:
+            print(json.dumps({'event': 'turn', 'sid': sid, 'step': step, 'next_step': state['step'],
+                              'seconds': round(elapsed, 4), 'stream': stream}), flush=True)
 
 # Ejecutar app
 if __name__ == '__main__':
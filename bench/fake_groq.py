@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita la API de chat completions de Groq para las pruebas
+de carga. La app se apunta a él con GROQ_BASE_URL=http://127.0.0.1:<puerto>.
+
+Uso: python -m bench.fake_groq --port 8100 --latency 0.4 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "¡Hola! Soy Kaisa, encantada de ayudarte. Cuéntame un poco más para preparar tu propuesta."
+
+
+class FakeGroqConfig:
+    def __init__(self, latency=0.3, jitter=0.1, chunk_delay=0.02, error_rate=0.0, error_status=429):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.endswith('/chat/completions'):
+                self._json(404, {'error': {'message': 'not found'}})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            config.requests += 1
+            time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+            if random.random() < config.error_rate:
+                config.errors += 1
+                self._json(config.error_status, {'error': {'message': 'error simulado', 'type': 'fake'}})
+                return
+
+            completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+            created = int(time.time())
+            model = body.get('model', 'fake-model')
+            words = REPLY.split(' ')
+            usage = {'prompt_tokens': len(json.dumps(body.get('messages', []))) // 4,
+                     'completion_tokens': len(words), 'total_tokens': 0}
+            usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+            if not body.get('stream'):
+                self._json(200, {
+                    'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': REPLY}}],
+                    'usage': usage
+                })
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for i, word in enumerate(words):
+                chunk = {
+                    'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'finish_reason': None,
+                                 'delta': {'content': word if i == 0 else ' ' + word}}]
+                }
+                self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(config.chunk_delay)
+            last = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'delta': {}}],
+                'x_groq': {'id': completion_id, 'usage': usage}
+            }
+            self.wfile.write(f'data: {json.dumps(last)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_fake_groq(port=0, config=None):
+    """Arranca el servidor en un hilo y devuelve (servidor, config)."""
+    config = config or FakeGroqConfig()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor falso de la API de Groq.')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.3, help='segundos hasta el primer byte')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help='segundos entre fragmentos en streaming')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fracción de peticiones que fallan')
+    parser.add_argument('--error-status', type=int, default=429)
+    args = parser.parse_args()
+    server, _ = start_fake_groq(args.port, FakeGroqConfig(
+        args.latency, args.jitter, args.chunk_delay, args.error_rate, args.error_status))
+    print(f"Groq falso escuchando en http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
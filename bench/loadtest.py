@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga del flujo completo del chat (nombre -> email -> negocio ->
+necesidades) contra un Groq falso local.
+
+Arranca la app como en producción (eventlet con wsgi.py o el comando de
+gunicorn del Procfile), lanza N clientes Socket.IO simultáneos y guarda en un
+JSON las conexiones/s, las latencias p50/p95/p99 por paso, los leads
+guardados por segundo y la memoria por conexión. Con --compare se comparan los
+resultados con los de una ejecución anterior. Además de requirements.txt
+necesita websocket-client para el transporte websocket de los clientes.
+
+Uso:
+    python -m bench.loadtest --server wsgi --clients 200 --stream --output bench_results.json
+    python -m bench.loadtest --server gunicorn --latency 1.0 --error-rate 0.05 --env LEADS_WRITE_BEHIND=1
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import shlex
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import socketio
+
+from bench.fake_groq import FakeGroqConfig, start_fake_groq
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = ('nombre', 'email', 'negocio', 'necesidades')
+BUSINESSES = ('restaurante', 'tienda', 'servicios', 'consultora de software')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Percentil por rango más cercano; None si no hay datos."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None
+    }
+
+
+def server_command(mode, port):
+    if mode == 'wsgi':
+        return [sys.executable, 'wsgi.py']
+    with open(os.path.join(ROOT, 'Procfile'), encoding='utf-8') as f:
+        web = next(line for line in f if line.startswith('web:'))
+    return shlex.split(web[len('web:'):]) + ['-b', f'127.0.0.1:{port}']
+
+
+def process_tree_rss_kb(pid):
+    """RSS del proceso y sus hijos (los workers de gunicorn), en KB."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+def wait_until_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al arrancar (código {process.returncode}).")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"El servidor no respondió en {timeout}s.")
+
+
+# Respuestas que indican que el paso no avanzó o que el lead no se guardó
+INVALID_EMAIL_REPLY = 'Ingresa un email válido'
+LEAD_SAVE_ERROR = 'Hubo un error guardando los datos'
+
+
+class StepFailed(Exception):
+    pass
+
+
+def wait_reply(replies, step, timeout):
+    """
+    Espera la respuesta del paso: ignora los avisos tardíos (followup) y
+    lanza StepFailed si la respuesta es un rechazo o no hace avanzar el flujo.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise StepFailed(f'{step}: sin respuesta en {timeout}s')
+        try:
+            received, data = replies.get(timeout=remaining)
+        except queue.Empty:
+            continue
+        if data.get('followup'):
+            continue
+        text = data.get('text', '')
+        if data.get('busy'):
+            raise StepFailed(f'{step}: rechazado por el servidor ({text})')
+        if INVALID_EMAIL_REPLY in text:
+            raise StepFailed(f'{step}: el servidor no aceptó el email')
+        if LEAD_SAVE_ERROR in text:
+            raise StepFailed(f'{step}: el lead no se guardó')
+        return received
+
+
+def run_client(index, url, args, results):
+    """Un usuario simulado recorre el flujo completo y anota sus latencias."""
+    replies = queue.Queue()
+    first_chunk = {}
+    # websocket-client añade su propio Origin; se suprime para enviar solo el de headers
+    client = socketio.Client(reconnection=False, websocket_extra_options={'suppress_origin': True})
+    client.on('message', lambda data: replies.put((time.perf_counter(), data)))
+    client.on('message_done', lambda data: replies.put((time.perf_counter(), data)))
+    client.on('message_chunk', lambda data: first_chunk.setdefault('at', time.perf_counter()))
+
+    messages = (
+        f'Usuario {index}',
+        f'usuario{index}@bench.local',
+        BUSINESSES[index % len(BUSINESSES)],
+        'Quiero vender por internet y recibir más clientes'
+    )
+    try:
+        start = time.perf_counter()
+        # El servidor solo acepta los orígenes de cors_allowed_origins, no el puerto del banco
+        client.connect(url, transports=args.transports, headers={'Origin': 'http://127.0.0.1:5000'})
+        connected = time.perf_counter()
+        results['connect'].append((start, connected))
+        wait_reply(replies, 'saludo', args.timeout)
+
+        for step, text in zip(STEPS, messages):
+            first_chunk.clear()
+            sent = time.perf_counter()
+            client.emit('message', {'text': text, 'stream': args.stream})
+            received = wait_reply(replies, step, args.timeout)
+            results['steps'][step].append(received - sent)
+            if 'at' in first_chunk:
+                results['ttft'][step].append(first_chunk['at'] - sent)
+        results['completed'].append(index)
+    except Exception as e:
+        results['errors'].append(f'{type(e).__name__}: {e}')
+    finally:
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+
+
+def count_leads(db_path):
+    try:
+        with sqlite3.connect(db_path) as conn:
+            return conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+def run(args):
+    fake, fake_config = start_fake_groq(0, FakeGroqConfig(
+        args.latency, args.jitter, args.chunk_delay, args.error_rate, args.error_status))
+    workdir = tempfile.mkdtemp(prefix='kaisa-bench-')
+    db_path = os.path.join(workdir, 'leads.db')
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+
+    env = dict(os.environ,
+               PORT=str(port),
+               GROQ_API_KEY='bench',
+               GROQ_BASE_URL=f'http://127.0.0.1:{fake.server_port}',
+               LEADS_DB_PATH=db_path,
+               LEADS_SPOOL_PATH=os.path.join(workdir, 'leads_spool.jsonl'),
+               PYTHONUNBUFFERED='1')
+    if not args.cache:
+        env['COMPLETION_CACHE_SIZE'] = '0'
+    if not args.admission:
+        # Todos los clientes simulados salen de 127.0.0.1: sin esto el control
+        # de admisión los rechazaría y se mediría la respuesta de 'ocupado'
+        env.update(RATE_LIMIT_IP='0', RATE_LIMIT_SID_RATE='1000', RATE_LIMIT_SID_BURST='1000',
+                   LLM_MAX_QUEUED='100000', DEDUP_WINDOW='0')
+    for item in args.env:
+        key, value = item.split('=', 1)
+        env[key] = value
+
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(server_command(args.server, port), cwd=ROOT, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_ready(url, process)
+        rss_baseline = process_tree_rss_kb(process.pid)
+        rss_peak = [rss_baseline]
+        sampling = threading.Event()
+
+        def sample_rss():
+            while not sampling.is_set():
+                rss_peak[0] = max(rss_peak[0], process_tree_rss_kb(process.pid))
+                sampling.wait(0.2)
+
+        results = {'connect': [], 'steps': {s: [] for s in STEPS}, 'ttft': {s: [] for s in STEPS},
+                   'completed': [], 'errors': []}
+        leads_before = count_leads(db_path)
+        threading.Thread(target=sample_rss, daemon=True).start()
+
+        started = time.perf_counter()
+        clients = []
+        for index in range(args.clients):
+            thread = threading.Thread(target=run_client, args=(index, url, args, results), daemon=True)
+            thread.start()
+            clients.append(thread)
+            if args.ramp:
+                time.sleep(args.ramp / args.clients)
+        for thread in clients:
+            thread.join()
+        finished = time.perf_counter()
+
+        # Con escritura diferida los últimos leads tardan un intervalo en llegar
+        time.sleep(args.settle)
+        sampling.set()
+        leads = count_leads(db_path) - leads_before
+        duration = finished - started
+
+        connect_times = [end - begin for begin, end in results['connect']]
+        if results['connect']:
+            window = max(end for _, end in results['connect']) - min(begin for begin, _ in results['connect'])
+        else:
+            window = 0
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+            'results': {
+                'duration_s': duration,
+                'clients_completed': len(results['completed']),
+                'errors': len(results['errors']),
+                'error_samples': results['errors'][:10],
+                'connections_per_s': len(connect_times) / window if window else None,
+                'connect_latency_s': summarize(connect_times),
+                'step_latency_s': {s: summarize(v) for s, v in results['steps'].items()},
+                'time_to_first_chunk_s': {s: summarize(v) for s, v in results['ttft'].items() if v},
+                'leads_persisted': leads,
+                # Clientes que completaron el flujo sin que su lead llegara a la base de datos
+                'leads_missing': max(0, len(results['completed']) - leads),
+                'leads_per_s': leads / duration if duration else None,
+                'rss_baseline_kb': rss_baseline,
+                'rss_peak_kb': rss_peak[0],
+                'memory_per_connection_kb': (rss_peak[0] - rss_baseline) / args.clients if args.clients else None,
+                'fake_groq': {'requests': fake_config.requests, 'errors': fake_config.errors}
+            },
+            'server_log': log_path
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        fake.shutdown()
+
+
+def compare(previous, current):
+    """Imprime la variación de las métricas principales respecto a otra ejecución."""
+    def delta(old, new):
+        if old in (None, 0) or new is None:
+            return 'n/a'
+        return f'{(new - old) / old * 100:+.1f}%'
+
+    old, new = previous['results'], current['results']
+    rows = [('connections_per_s', old['connections_per_s'], new['connections_per_s']),
+            ('leads_per_s', old['leads_per_s'], new['leads_per_s']),
+            ('memory_per_connection_kb', old['memory_per_connection_kb'], new['memory_per_connection_kb'])]
+    for step in STEPS:
+        for pct in ('p50', 'p95', 'p99'):
+            rows.append((f'{step}.{pct}', old['step_latency_s'][step][pct], new['step_latency_s'][step][pct]))
+    print(f"{'métrica':<28}{'anterior':>14}{'actual':>14}{'cambio':>10}")
+    for name, a, b in rows:
+        fa = f'{a:.4f}' if a is not None else '-'
+        fb = f'{b:.4f}' if b is not None else '-'
+        print(f'{name:<28}{fa:>14}{fb:>14}{delta(a, b):>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga del chat con un Groq falso.')
+    parser.add_argument('--server', choices=['wsgi', 'gunicorn'], default='wsgi',
+                        help='wsgi.py (eventlet) o el comando gunicorn del Procfile')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--ramp', type=float, default=0.0, help='segundos para repartir el arranque de los clientes')
+    parser.add_argument('--stream', action='store_true', help='pedir respuestas por fragmentos')
+    parser.add_argument('--transports', nargs='+', default=['websocket', 'polling'])
+    parser.add_argument('--timeout', type=float, default=60.0, help='espera máxima por respuesta')
+    parser.add_argument('--settle', type=float, default=3.0, help='espera final antes de contar los leads')
+    parser.add_argument('--cache', action='store_true', help='mantener activa la caché de respuestas')
+    parser.add_argument('--admission', action='store_true',
+                        help='mantener los límites de admisión por defecto (se desactivan si no)')
+    parser.add_argument('--latency', type=float, default=0.3, help='latencia del Groq falso (s)')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=429)
+    parser.add_argument('--env', action='append', default=[], metavar='CLAVE=VALOR',
+                        help='variables de entorno adicionales para el servidor')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help='JSON de una ejecución anterior para comparar')
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    r = report['results']
+    print(f"{r['clients_completed']}/{args.clients} clientes completaron el flujo, {r['errors']} error(es).")
+    if r['leads_missing']:
+        print(f"AVISO: faltan {r['leads_missing']} lead(s) de clientes que completaron el flujo.")
+    for sample in r['error_samples']:
+        print(f"  error: {sample}")
+    print(f"Conexiones/s: {r['connections_per_s']}, leads/s: {r['leads_per_s']}, "
+          f"memoria por conexión: {r['memory_per_connection_kb']} KB")
+    for step, stats in r['step_latency_s'].items():
+        print(f"  {step:<12} p50={stats['p50']} p95={stats['p95']} p99={stats['p99']}")
+    print(f"Resultados guardados en {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
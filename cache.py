@@ -0,0 +1,151 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Valores más cortos no se sustituyen para no mutilar palabras corrientes
+MIN_PLACEHOLDER_LEN = 3
+
+
+def _whole_word(value):
+    # Sin \b: los valores pueden empezar o acabar en caracteres no alfanuméricos
+    return re.compile(r'(?<!\w)' + re.escape(value) + r'(?!\w)', re.IGNORECASE)
+
+
+def to_placeholders(text, values):
+    """
+    Reemplaza en text cada valor concreto (nombre, email...) por su marcador,
+    p. ej. {'{{nombre}}': 'Ana'} convierte 'Hola Ana' en 'Hola {{nombre}}'.
+    Solo se sustituyen palabras completas ('Eva' no toca 'nueva'), y los
+    valores largos primero para que el nombre no rompa un email que lo contiene.
+    """
+    for placeholder, value in sorted(values.items(), key=lambda item: -len(item[1] or '')):
+        value = (value or '').strip()
+        if len(value) >= MIN_PLACEHOLDER_LEN:
+            text = _whole_word(value).sub(placeholder, text)
+    return text
+
+
+def to_cacheable(text, values):
+    """
+    Versión con marcadores de una respuesta, o None si aún contiene parte de
+    algún valor (p. ej. 'Juan' cuando el nombre guardado es 'Me llamo Juan
+    Pérez'). Esas respuestas no se cachean para no mostrarlas a otro usuario.
+    """
+    text = to_placeholders(text, values)
+    for value in values.values():
+        for word in re.findall(r'\w{2,}', value or ''):
+            if _whole_word(word).search(text):
+                return None
+    return text
+
+
+def from_placeholders(text, values):
+    """Operación inversa de to_placeholders."""
+    for placeholder, value in values.items():
+        text = text.replace(placeholder, (value or '').strip())
+    return text
+
+
+def normalize_prompt(prompt, values):
+    """Forma canónica de un prompt: marcadores, minúsculas y espacios colapsados."""
+    prompt = to_placeholders(prompt, values)
+    return _WHITESPACE.sub(' ', prompt).strip().lower()
+
+
+class CompletionCache:
+    """
+    Caché de respuestas del LLM: LRU en memoria con caducidad (TTL) y, de
+    forma opcional, un segundo nivel persistente en SQLite que sobrevive a
+    reinicios y se comparte entre procesos.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if db_path:
+            with self._db() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS completion_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                ''')
+
+    @staticmethod
+    def make_key(step, normalized_prompt):
+        return hashlib.sha1(f"{step}\0{normalized_prompt}".encode('utf-8')).hexdigest()
+
+    def _db(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._db_get(key, now) if self.db_path else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, value, now + self.ttl)
+        return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.db_path:
+            try:
+                with self._db() as conn:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO completion_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                        (key, value, expires_at)
+                    )
+            except sqlite3.Error as e:
+                print("Error guardando en la caché persistente:", e)
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _db_get(self, key, now):
+        try:
+            with self._db() as conn:
+                row = conn.execute(
+                    'SELECT value FROM completion_cache WHERE key = ? AND expires_at > ?',
+                    (key, now)
+                ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print("Error leyendo la caché persistente:", e)
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
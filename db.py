@@ -0,0 +1,290 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+LEADS_DB_PATH = os.getenv('LEADS_DB_PATH', 'leads.db')
+
+# Usar %s para PostgreSQL y ? para SQLite
+PLACEHOLDER = '%s' if DATABASE_URL else '?'
+LEAD_COLUMNS = ('name', 'email', 'business_type', 'needs')
+
+# Función para obtener una conexión nueva a la base de datos
+def get_db_connection():
+    if DATABASE_URL:
+        import psycopg2
+        return psycopg2.connect(DATABASE_URL)
+    else:
+        # Las conexiones del pool pueden usarse desde distintos hilos
+        return sqlite3.connect(LEADS_DB_PATH, timeout=10, check_same_thread=False)
+
+
+class ConnectionPool:
+    """
+    Pool sencillo de conexiones válido para PostgreSQL y SQLite. Reutiliza
+    hasta max_size conexiones ociosas; las que fallan se descartan en lugar
+    de devolverse al pool. is_disconnect(e) indica si un error se debe a una
+    conexión caída (reinicio del servidor, cierre por inactividad): run()
+    reintenta entonces una vez con una conexión nueva.
+    """
+
+    def __init__(self, connect, max_size=5, is_disconnect=lambda e: False):
+        self._connect = connect
+        self.max_size = max_size
+        self.is_disconnect = is_disconnect
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        """Devuelve (conexión, reutilizada)."""
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not getattr(conn, 'closed', False):
+                    return conn, True
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def _transaction(self, conn):
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            raise
+        self._release(conn)
+
+    @contextmanager
+    def connection(self):
+        """Entrega una conexión; confirma al salir o revierte y la descarta si hay error."""
+        conn, _ = self._acquire()
+        with self._transaction(conn):
+            yield conn
+
+    def run(self, fn):
+        """
+        Ejecuta fn(conn) en una transacción. Si la conexión reutilizada estaba
+        caída, se descarta y fn se repite una vez con una conexión nueva.
+        """
+        conn, reused = self._acquire()
+        try:
+            with self._transaction(conn):
+                return fn(conn)
+        except Exception as e:
+            if not (reused and self.is_disconnect(e)):
+                raise
+            print("Conexión del pool caída, se reintenta con una nueva:", e)
+        with self._transaction(self._connect()) as conn:
+            return fn(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+# Errores de una conexión PostgreSQL que dejó de servir mientras estaba en el pool
+def is_connection_lost(e):
+    if not DATABASE_URL:
+        return False
+    import psycopg2
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+db_pool = ConnectionPool(get_db_connection, max_size=int(os.getenv('DB_POOL_SIZE', '5')),
+                         is_disconnect=is_connection_lost)
+
+# Inicializar DB
+def init_db():
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        if DATABASE_URL:
+            # Sintaxis para PostgreSQL
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS leads (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    business_type TEXT,
+                    needs TEXT,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        else:
+            # Sintaxis para SQLite
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS leads (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    business_type TEXT,
+                    needs TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        cursor.close()
+
+    # Índices para la exportación paginada por (created_at, id) y búsquedas por email
+    indexes = ('CREATE INDEX {} IF NOT EXISTS idx_leads_created_at_id ON leads (created_at, id)',
+               'CREATE INDEX {} IF NOT EXISTS idx_leads_email ON leads (email)')
+    if DATABASE_URL:
+        # CONCURRENTLY no bloquea los INSERT del chat mientras se construye el
+        # índice sobre una tabla grande, pero no admite transacciones.
+        conn = get_db_connection()
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            for sql in indexes:
+                cursor.execute(sql.format('CONCURRENTLY'))
+            cursor.close()
+        finally:
+            conn.close()
+    else:
+        with db_pool.connection() as conn:
+            for sql in indexes:
+                conn.execute(sql.format(''))
+
+# Inserta varios leads en una sola operación
+def insert_leads(conn, leads):
+    rows = [tuple(lead[col] for col in LEAD_COLUMNS) for lead in leads]
+    columns = ', '.join(LEAD_COLUMNS)
+    with metrics.db_insert_seconds.time():
+        cursor = conn.cursor()
+        if DATABASE_URL:
+            # INSERT multi-fila en PostgreSQL
+            from psycopg2.extras import execute_values
+            execute_values(cursor, f'INSERT INTO leads ({columns}) VALUES %s', rows)
+        else:
+            values = ', '.join([PLACEHOLDER] * len(LEAD_COLUMNS))
+            cursor.executemany(f'INSERT INTO leads ({columns}) VALUES ({values})', rows)
+        cursor.close()
+    metrics.leads_inserted.inc(len(rows))
+
+
+class LeadWriter:
+    """
+    Escritura diferida de leads: step_3 solo encola y una tarea en segundo
+    plano los inserta por lotes, cuando se alcanzan batch_size leads o cada
+    interval segundos. Si la base de datos no responde, el lote se guarda en
+    un fichero JSONL (spool_path) y se reintenta en el siguiente volcado.
+    """
+
+    def __init__(self, pool, spawn, event_factory, batch_size=50, interval=2.0,
+                 spool_path='leads_spool.jsonl'):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_path = spool_path
+        self._spawn = spawn
+        self._wake = event_factory()
+        self._queue = deque()
+        self._flush_lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            self._spawn(self._run)
+
+    def enqueue(self, lead):
+        self._queue.append({col: lead.get(col, '') for col in LEAD_COLUMNS})
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def pending(self):
+        return len(self._queue)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            # Un fallo inesperado no debe detener la tarea de volcado
+            try:
+                self.flush()
+            except Exception as e:
+                print("Error inesperado volcando leads:", e)
+
+    def flush(self):
+        """Vuelca lo pendiente (y lo que haya en el spool). Devuelve los leads guardados."""
+        with self._flush_lock:
+            try:
+                saved = self._replay_spool()
+            except Exception as e:
+                print("Error reprocesando el spool de leads:", e)
+                saved = 0
+            while self._queue:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                try:
+                    self.pool.run(lambda conn: insert_leads(conn, batch))
+                    saved += len(batch)
+                except Exception as e:
+                    print(f"Error guardando {len(batch)} lead(s), se guardan en {self.spool_path}:", e)
+                    self._spool(batch + [self._queue.popleft() for _ in range(len(self._queue))])
+                    break
+            return saved
+
+    def _spool(self, leads):
+        with open(self.spool_path, 'a+', encoding='utf-8') as f:
+            # Si una escritura anterior quedó a medias, empezar en una línea nueva
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                if f.read(1) != '\n':
+                    f.write('\n')
+            for lead in leads:
+                f.write(json.dumps(lead, ensure_ascii=False) + '\n')
+
+    def _replay_spool(self):
+        if not os.path.exists(self.spool_path):
+            return 0
+        leads, bad_lines = [], []
+        with open(self.spool_path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    lead = json.loads(line)
+                    leads.append({col: lead.get(col, '') for col in LEAD_COLUMNS})
+                except (ValueError, AttributeError):
+                    # Línea truncada (p. ej. caída durante _spool): se aparta para revisarla
+                    bad_lines.append(line if line.endswith('\n') else line + '\n')
+        if bad_lines:
+            print(f"{len(bad_lines)} línea(s) ilegibles del spool movidas a {self.spool_path}.bad")
+            with open(self.spool_path + '.bad', 'a', encoding='utf-8') as f:
+                f.writelines(bad_lines)
+            # Reescribir el spool solo con los leads válidos
+            tmp_path = self.spool_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for lead in leads:
+                    f.write(json.dumps(lead, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.spool_path)
+        if leads:
+            try:
+                self.pool.run(lambda conn: insert_leads(conn, leads))
+            except Exception as e:
+                print("La base de datos sigue sin responder, el spool se conserva:", e)
+                return 0
+        os.remove(self.spool_path)
+        return len(leads)
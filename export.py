@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+import os
+
+from db import DATABASE_URL, PLACEHOLDER, db_pool
+
+EXPORT_COLUMNS = ('id', 'name', 'email', 'business_type', 'needs', 'created_at')
+
+
+def iter_leads(after=None, page_size=1000, descending=False):
+    """
+    Recorre los leads en orden (created_at, id) sin cargarlos todos en memoria.
+
+    after es un cursor (created_at, id): solo se devuelven los leads
+    posteriores (o anteriores si descending). En PostgreSQL se usa un cursor
+    del lado del servidor; en SQLite, paginación por clave con una lectura
+    corta por página para no bloquear las inserciones del chat.
+    """
+    op, order = ('<', 'DESC') if descending else ('>', 'ASC')
+    columns = ', '.join(EXPORT_COLUMNS)
+    where = f'WHERE (created_at, id) {op} ({PLACEHOLDER}, {PLACEHOLDER})'
+
+    if DATABASE_URL:
+        sql = f'SELECT {columns} FROM leads {where if after else ""} ORDER BY created_at {order}, id {order}'
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(name='leads_export')
+            cursor.itersize = page_size
+            cursor.execute(sql, tuple(after) if after else None)
+            for row in cursor:
+                yield dict(zip(EXPORT_COLUMNS, row))
+            cursor.close()
+        return
+
+    while True:
+        sql = f'SELECT {columns} FROM leads {where if after else ""} ORDER BY created_at {order}, id {order} LIMIT {int(page_size)}'
+        with db_pool.connection() as conn:
+            rows = conn.execute(sql, tuple(after) if after else ()).fetchall()
+        for row in rows:
+            yield dict(zip(EXPORT_COLUMNS, row))
+        if len(rows) < page_size:
+            return
+        after = (rows[-1][-1], rows[-1][0])
+
+
+def _serializable(lead):
+    created_at = lead['created_at']
+    if hasattr(created_at, 'isoformat'):
+        lead = dict(lead, created_at=created_at.isoformat())
+    return lead
+
+
+def iter_csv(leads):
+    """Genera el CSV línea a línea (con cabecera)."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for lead in leads:
+        writer.writerow(_serializable(lead))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(leads):
+    for lead in leads:
+        yield json.dumps(_serializable(lead), ensure_ascii=False) + '\n'
+
+
+FORMATS = {'csv': iter_csv, 'jsonl': iter_jsonl}
+
+
+class ExportCursor:
+    """
+    Recuerda el último lead exportado (created_at, id) en un fichero JSON para
+    las exportaciones incrementales ("desde la última exportación").
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.position = None
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.position = (data['created_at'], data['id'])
+
+    def track(self, leads):
+        """Deja pasar los leads anotando la posición del último."""
+        for lead in leads:
+            yield lead
+            self.position = (_serializable(lead)['created_at'], lead['id'])
+
+    def save(self):
+        if self.position is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': self.position[0], 'id': self.position[1]}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el tiempo total permitido para una llamada al LLM."""
+
+
+def call_with_retry(fn, deadline, is_retryable, max_retries=3,
+                    base_delay=0.5, max_delay=4.0, sleep=time.sleep):
+    """
+    Ejecuta fn(timeout) reintentando los errores transitorios (429/5xx) con
+    backoff exponencial y jitter completo, sin superar el plazo total
+    `deadline` (en segundos). A fn se le pasa el tiempo restante para que lo
+    use como timeout de la petición HTTP.
+    """
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        remaining = deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Plazo de {deadline}s agotado tras {attempt} intento(s).")
+        try:
+            return fn(remaining)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if time.monotonic() - start + delay >= deadline:
+                raise
+            attempt += 1
+            print(f"Reintentando llamada al LLM ({attempt}/{max_retries}) en {delay:.2f}s:", e)
+            sleep(delay)
+
+
+class LLMDispatcher:
+    """
+    Planificador de turnos de conversación con concurrencia acotada.
+
+    Un número fijo de tareas de trabajo consume una cola global; cada sid
+    tiene su propia cola FIFO y como máximo un turno en curso, de modo que los
+    mensajes de un usuario se procesan en orden mientras los de otros usuarios
+    avanzan en paralelo. `spawn` y `queue_factory` deben ser los del modo
+    asíncrono activo (eventlet, gevent o hilos) para no bloquear el bucle.
+    Con max_queued se limita el total de turnos en espera; por encima de ese
+    número submit rechaza el turno. Los sid cancelados se recuerdan durante
+    cancel_ttl segundos para que las llamadas al LLM que sigan en curso (o
+    lleguen tarde) puedan abandonarse.
+    """
+
+    def __init__(self, spawn, queue_factory, workers=8, max_queued=None, cancel_ttl=60.0):
+        self._spawn = spawn
+        self._ready = queue_factory()
+        self._workers = workers
+        self.max_queued = max_queued
+        self.cancel_ttl = cancel_ttl
+        self._queued = 0
+        self._started = False
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._active = set()
+        self._cancelled = OrderedDict()
+
+    def _start(self):
+        self._started = True
+        for _ in range(self._workers):
+            self._spawn(self._worker)
+
+    def submit(self, sid, fn, *args):
+        """Encola fn(*args) como el siguiente turno del sid. Devuelve False si la cola está llena."""
+        with self._lock:
+            if self.max_queued is not None and self._queued >= self.max_queued:
+                return False
+            if not self._started:
+                self._start()
+            self._pending.setdefault(sid, deque()).append((fn, args, time.monotonic()))
+            self._queued += 1
+            if sid not in self._active:
+                self._active.add(sid)
+                self._ready.put(sid)
+            return True
+
+    def cancel(self, sid):
+        """
+        Descarta los turnos pendientes de un sid (p. ej. al desconectarse) y lo
+        marca como cancelado: el turno en curso no vuelve a guardar su estado
+        y las llamadas al LLM de ese sid se cortan en el siguiente fragmento.
+        """
+        now = time.monotonic()
+        with self._lock:
+            jobs = self._pending.get(sid)
+            if jobs:
+                self._queued -= len(jobs)
+                jobs.clear()
+            while self._cancelled and next(iter(self._cancelled.values())) <= now:
+                self._cancelled.popitem(last=False)
+            self._cancelled[sid] = now + self.cancel_ttl
+            self._cancelled.move_to_end(sid)
+
+    def cancelled(self, sid):
+        with self._lock:
+            return self._cancelled.get(sid, 0) > time.monotonic()
+
+    def pending(self, sid):
+        with self._lock:
+            return len(self._pending.get(sid, ()))
+
+    def busy(self, sid):
+        """True si el sid tiene un turno en curso o en espera."""
+        with self._lock:
+            return sid in self._active
+
+    def queued(self):
+        return self._queued
+
+    def _next_job(self, sid):
+        with self._lock:
+            jobs = self._pending.get(sid)
+            if jobs:
+                self._queued -= 1
+                return jobs.popleft()
+            self._pending.pop(sid, None)
+            self._active.discard(sid)
+            return None
+
+    def _release(self, sid):
+        with self._lock:
+            if self._pending.get(sid):
+                self._ready.put(sid)
+            else:
+                self._pending.pop(sid, None)
+                self._active.discard(sid)
+
+    def _worker(self):
+        while True:
+            sid = self._ready.get()
+            job = self._next_job(sid)
+            if job is None:
+                continue
+            fn, args, submitted = job
+            # Tiempo en cola: crece cuando los trabajadores no dan abasto
+            metrics.llm_queue_wait.observe(time.monotonic() - submitted)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Error procesando turno de {sid}:", e)
+            finally:
+                self._release(sid)
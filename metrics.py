@@ -0,0 +1,179 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+# Límites de los histogramas de latencia (segundos)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """
+    Contador monótono. No usa locks: bajo eventlet/gevent no hay expropiación
+    entre la lectura y la escritura, y con hilos reales la pérdida ocasional
+    de un incremento es aceptable para métricas.
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Valor instantáneo; con set_function se calcula al exportar."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._function = None
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, amount=1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def set_function(self, function):
+        """function() devuelve {tupla_de_etiquetas: valor}."""
+        self._function = function
+
+    def render(self):
+        values = self._function() if self._function else self._values
+        lines = self.header()
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Histograma de cubetas fijas: observar es una búsqueda binaria y un incremento."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            # [cuentas por cubeta (+Inf al final), suma, total]
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = self.header()
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.label_names + ('le',), labels + (bound,))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            base = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{base} {total}')
+            lines.append(f'{self.name}_count{base} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Todas las métricas en formato de texto de Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+turn_seconds = registry.register(Histogram(
+    'chat_turn_seconds', 'Tiempo de proceso de un mensaje por paso de la conversación.', labels=('step',)))
+groq_seconds = registry.register(Histogram(
+    'groq_request_seconds', 'Latencia de las llamadas a Groq.', labels=('mode',)))
+groq_tokens = registry.register(Counter(
+    'groq_tokens_total', 'Tokens consumidos en Groq.', labels=('kind',)))
+groq_errors = registry.register(Counter(
+    'groq_errors_total', 'Llamadas a Groq fallidas.'))
+db_insert_seconds = registry.register(Histogram(
+    'db_insert_seconds', 'Latencia de las inserciones de leads.'))
+leads_inserted = registry.register(Counter(
+    'leads_inserted_total', 'Leads guardados en la base de datos.'))
+active_connections = registry.register(Gauge(
+    'socketio_active_connections', 'Conexiones Socket.IO abiertas.'))
+funnel = registry.register(Counter(
+    'chat_funnel_total', 'Conversaciones que alcanzan cada paso (0 = conexión, 4 = lead completo).', labels=('step',)))
+template_replies = registry.register(Counter(
+    'chat_template_replies_total', 'Respuestas de plantilla enviadas en lugar del LLM.', labels=('step',)))
+admission_rejected = registry.register(Counter(
+    'admission_rejected_total', 'Mensajes rechazados por el control de admisión.', labels=('reason',)))
+llm_inflight = registry.register(Gauge(
+    'llm_inflight', 'Llamadas al LLM en curso y turnos en espera.', labels=('state',)))
+llm_queue_wait = registry.register(Histogram(
+    'llm_queue_wait_seconds', 'Espera de un turno desde que se encola hasta que lo toma un trabajador.'))
+loop_lag = registry.register(Histogram(
+    'event_loop_lag_seconds', 'Retraso del bucle de eventos respecto a una espera de 1 s (bloqueos de eventlet/gevent).'))
+cache_stats = registry.register(Gauge(
+    'completion_cache', 'Estadísticas de la caché de respuestas.', labels=('stat',)))
+
+
+def record_usage(usage):
+    """Suma los tokens de un objeto usage de Groq (si lo hay)."""
+    if usage is None:
+        return
+    groq_tokens.inc(getattr(usage, 'prompt_tokens', 0) or 0, 'prompt')
+    groq_tokens.inc(getattr(usage, 'completion_tokens', 0) or 0, 'completion')
+
+
+def monitor_loop_lag(sleep, interval=1.0):
+    """Tarea en segundo plano: mide cuánto se retrasa sleep(interval) respecto a lo pedido."""
+    while True:
+        start = time.perf_counter()
+        sleep(interval)
+        loop_lag.observe(max(0.0, time.perf_counter() - start - interval))
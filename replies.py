@@ -0,0 +1,107 @@
+import threading
+import time
+
+# Presupuesto de latencia por paso (segundos hasta el primer fragmento o la respuesta completa)
+DEFAULT_BUDGETS = {0: 3.0, 1: 3.0, 2: 4.0, 3: 4.0}
+DEFAULT_BUDGET = 3.0
+
+
+def parse_budgets(spec):
+    """Convierte '0=2.5,2=4' en {0: 2.5, 2: 4.0} sobre los valores por defecto."""
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in (spec or '').split(','):
+        if item.strip():
+            step, seconds = item.split('=')
+            budgets[int(step)] = float(seconds)
+    return budgets
+
+
+class StreamAbandoned(Exception):
+    """El turno ya respondió por plazo agotado; se corta el streaming del LLM."""
+
+
+class ReplyEngine:
+    """
+    Motor de respuestas híbrido: el LLM compite contra el presupuesto de
+    latencia del paso y, si no responde a tiempo, falla o no está disponible,
+    se envía de inmediato la plantilla del paso. La respuesta tardía del LLM
+    se descarta (late_mode='drop') o se entrega aparte con on_late
+    (late_mode='followup'). Ningún turno espera más de deadline segundos en
+    total, aunque el LLM siga enviando fragmentos.
+    """
+
+    def __init__(self, spawn, event_factory, budgets=None, late_mode='drop', deadline=20.0):
+        self._spawn = spawn
+        self._event_factory = event_factory
+        self.budgets = budgets if budgets is not None else dict(DEFAULT_BUDGETS)
+        self.late_mode = late_mode
+        self.deadline = deadline
+
+    def reply(self, step, template, generate, on_chunk=None, on_late=None, available=True,
+              cancelled=None):
+        """
+        generate(on_chunk) debe devolver el texto del LLM o lanzar una
+        excepción. Con on_chunk el presupuesto cubre solo el primer fragmento:
+        después se espera al texto completo hasta agotar deadline, y entonces
+        se devuelve lo recibido hasta el momento. Si cancelled() pasa a ser
+        cierto (cliente desconectado), el streaming se corta en el siguiente
+        fragmento aunque la respuesta ya llegue tarde.
+        """
+        if not available:
+            return template
+
+        start = time.monotonic()
+        lock = threading.Lock()
+        result = {'text': None, 'error': None, 'streamed': False, 'late': False,
+                  'abandoned': False, 'parts': []}
+        started = self._event_factory()
+        finished = self._event_factory()
+
+        def forward(delta):
+            if cancelled and cancelled():
+                raise StreamAbandoned(f"Cliente desconectado durante el paso {step}.")
+            with lock:
+                if result['abandoned']:
+                    raise StreamAbandoned(f"Plazo total de {self.deadline}s agotado en el paso {step}.")
+                if result['late']:
+                    return
+                result['streamed'] = True
+                result['parts'].append(delta)
+            started.set()
+            on_chunk(delta)
+
+        def run():
+            try:
+                result['text'] = generate(forward if on_chunk else None)
+            except StreamAbandoned as e:
+                print(f"Se corta la respuesta del LLM (paso {step}):", e)
+                result['error'] = e
+            except Exception as e:
+                print(f"Error generando respuesta con el LLM (paso {step}):", e)
+                result['error'] = e
+            with lock:
+                late = result['late'] and not result['abandoned']
+            started.set()
+            finished.set()
+            if cancelled and cancelled():
+                return
+            if late and result['text'] and self.late_mode == 'followup' and on_late:
+                on_late(result['text'])
+
+        self._spawn(run)
+        started.wait(self.budgets.get(step, DEFAULT_BUDGET))
+        with lock:
+            if not result['streamed'] and result['text'] is None and result['error'] is None:
+                result['late'] = True
+        if result['late']:
+            print(f"El LLM superó el presupuesto del paso {step}, se envía la plantilla.")
+            return template
+
+        finished.wait(max(0.0, self.deadline - (time.monotonic() - start)))
+        with lock:
+            if result['text'] is None and result['error'] is None:
+                result['abandoned'] = True
+                partial = ''.join(result['parts']).strip()
+                print(f"El LLM superó el plazo total del paso {step}, se envía lo recibido.")
+                return partial or template
+        return result['text'] if result['text'] else template
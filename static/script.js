@@ -4,6 +4,11 @@ socket.on('connect', () => console.log('Conectado al servidor WebSocket'));
 socket.on('connect_error', (err) => console.log('Error de conexión:', err));
 
 socket.on('message', (data) => { removeTypingIndicator(); appendMessage(data.text, 'bot'); });
+socket.on('typing_done', () => removeTypingIndicator());
+
+// Respuestas por fragmentos: una misma burbuja crece hasta 'message_done'
+socket.on('message_chunk', (data) => { const msgDiv = getStreamBubble(data.id); msgDiv.textContent += data.text; scrollToBottom(); });
+socket.on('message_done', (data) => { const msgDiv = getStreamBubble(data.id); msgDiv.textContent = data.text; delete msgDiv.dataset.id; scrollToBottom(); });
 
 function sendMessage() {
     const input = document.getElementById('chat-input');
@@ -11,7 +16,7 @@ function sendMessage() {
     if (!message) return;
 
     appendMessage(message, 'user');
-    socket.emit('message', { text: message });
+    socket.emit('message', { text: message, stream: true });
     input.value = '';
     addTypingIndicator();
 }
@@ -23,9 +28,27 @@ function appendMessage(text, sender) {
     msgDiv.textContent = text;
     messages.appendChild(msgDiv);
     messages.scrollTop = messages.scrollHeight;
+    return msgDiv;
+}
+
+function getStreamBubble(id) {
+    let msgDiv = document.querySelector(`.message.bot[data-id="${id}"]`);
+    if (!msgDiv) {
+        removeTypingIndicator();
+        msgDiv = appendMessage('', 'bot');
+        msgDiv.dataset.id = id;
+    }
+    return msgDiv;
+}
+
+function scrollToBottom() {
+    const messages = document.getElementById('chat-messages');
+    messages.scrollTop = messages.scrollHeight;
 }
 
 function addTypingIndicator() {
+    // Un solo indicador aunque se envíen varios mensajes antes de la respuesta
+    if (document.getElementById('typing-indicator')) return;
     const messages = document.getElementById('chat-messages');
     const typing = document.createElement('div');
     typing.id = 'typing-indicator';
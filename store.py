@@ -0,0 +1,169 @@
+import sqlite3
+import threading
+import time
+
+
+class ConversationState:
+    """
+    Estado de una conversación. Usa __slots__ para ocupar poco por conexión y
+    admite acceso tipo diccionario (state['name'], state.get('step')) para que
+    los manejadores de pasos no dependan de la implementación.
+    """
+
+    FIELDS = ('step', 'name', 'email', 'business_type', 'needs')
+    __slots__ = FIELDS + ('touched',)
+
+    def __init__(self, step=0, name='', email='', business_type='', needs=''):
+        self.step = step
+        self.name = name
+        self.email = email
+        self.business_type = business_type
+        self.needs = needs
+        self.touched = time.monotonic()
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def to_tuple(self):
+        return tuple(getattr(self, f) for f in self.FIELDS)
+
+
+class ConversationStore:
+    """Interfaz común de los almacenes de conversaciones, indexados por sid."""
+
+    def load(self, sid):
+        """Devuelve el ConversationState del sid o None si no existe (o caducó)."""
+        raise NotImplementedError
+
+    def save(self, sid, state):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+
+class MemoryConversationStore(ConversationStore):
+    """
+    Almacén en memoria del proceso. Las conversaciones sin actividad durante
+    idle_ttl segundos se eliminan, así los sockets abandonados no acumulan
+    memoria aunque nunca llegue el evento de desconexión.
+    """
+
+    def __init__(self, idle_ttl=1800, sweep_every=256):
+        self.idle_ttl = idle_ttl
+        self.sweep_every = sweep_every
+        self._states = {}
+        self._ops = 0
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            state = self._states.get(sid)
+            if state is None:
+                return None
+            if now - state.touched > self.idle_ttl:
+                del self._states[sid]
+                return None
+            state.touched = now
+            return state
+
+    def save(self, sid, state):
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_sweep(now)
+            state.touched = now
+            self._states[sid] = state
+
+    def delete(self, sid):
+        with self._lock:
+            self._states.pop(sid, None)
+
+    def __len__(self):
+        return len(self._states)
+
+    def _maybe_sweep(self, now):
+        self._ops += 1
+        if self._ops < self.sweep_every:
+            return
+        self._ops = 0
+        expired = [sid for sid, state in self._states.items() if now - state.touched > self.idle_ttl]
+        for sid in expired:
+            del self._states[sid]
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Almacén en un fichero SQLite, compartido por varios procesos de la misma
+    máquina. Las filas inactivas más de idle_ttl segundos se purgan.
+    """
+
+    def __init__(self, path, idle_ttl=1800, sweep_every=256):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.sweep_every = sweep_every
+        self._ops = 0
+        with self._db() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS conversations (
+                    sid TEXT PRIMARY KEY,
+                    step INTEGER NOT NULL,
+                    name TEXT,
+                    email TEXT,
+                    business_type TEXT,
+                    needs TEXT,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, sid):
+        with self._db() as conn:
+            row = conn.execute(
+                'SELECT step, name, email, business_type, needs FROM conversations '
+                'WHERE sid = ? AND updated_at > ?',
+                (sid, time.time() - self.idle_ttl)
+            ).fetchone()
+        return ConversationState(*row) if row else None
+
+    def save(self, sid, state):
+        with self._db() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO conversations '
+                '(sid, step, name, email, business_type, needs, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (sid,) + state.to_tuple() + (time.time(),)
+            )
+            self._ops += 1
+            if self._ops >= self.sweep_every:
+                self._ops = 0
+                conn.execute('DELETE FROM conversations WHERE updated_at <= ?', (time.time() - self.idle_ttl,))
+
+    def delete(self, sid):
+        with self._db() as conn:
+            conn.execute('DELETE FROM conversations WHERE sid = ?', (sid,))
+
+
+def create_conversation_store(url, idle_ttl=1800):
+    """
+    Crea el almacén indicado por url: 'memory' (por defecto) o
+    'sqlite:///ruta/al/fichero.db'.
+    """
+    if not url or url == 'memory':
+        return MemoryConversationStore(idle_ttl=idle_ttl)
+    if url.startswith('sqlite:///'):
+        return SQLiteConversationStore(url[len('sqlite:///'):], idle_ttl=idle_ttl)
+    raise ValueError(f"CONVERSATION_STORE no soportado: {url}")
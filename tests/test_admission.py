@@ -0,0 +1,85 @@
+from admission import DuplicateFilter, InflightLimiter, TokenBucketLimiter, truncate_input
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_refills():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=2, burst=3, clock=clock)
+    assert [limiter.allow('a') for _ in range(4)] == [True, True, True, False]
+
+    clock.now += 0.5  # 2 tokens/s -> 1 token
+    assert limiter.allow('a')
+    assert not limiter.allow('a')
+
+    # La recarga nunca supera el burst
+    clock.now += 60
+    assert [limiter.allow('a') for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_keys_are_independent():
+    limiter = TokenBucketLimiter(rate=1, burst=1, clock=FakeClock())
+    assert limiter.allow('a')
+    assert not limiter.allow('a')
+    assert limiter.allow('b')
+
+
+def test_token_bucket_evicts_least_recently_used_key():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=1, burst=1, max_keys=2, clock=clock)
+    limiter.allow('a')
+    limiter.allow('b')
+    limiter.allow('a')  # 'b' pasa a ser la menos usada
+    limiter.allow('c')
+    assert len(limiter) == 2
+    # 'a' conserva su cubo vacío; 'b' fue expulsada y empieza llena
+    assert not limiter.allow('a')
+    assert limiter.allow('b')
+
+
+def test_token_bucket_forget_resets_key():
+    limiter = TokenBucketLimiter(rate=1, burst=1, clock=FakeClock())
+    limiter.allow('a')
+    limiter.forget('a')
+    assert len(limiter) == 0
+    assert limiter.allow('a')
+
+
+def test_duplicate_filter_window_expires():
+    clock = FakeClock()
+    dedup = DuplicateFilter(window=2.0, clock=clock)
+    assert not dedup.is_duplicate('a', 'hola')
+    clock.now += 1.0
+    assert dedup.is_duplicate('a', 'hola')
+    assert not dedup.is_duplicate('b', 'hola')
+    assert not dedup.is_duplicate('a', 'otra cosa')
+
+    clock.now += 2.5
+    assert not dedup.is_duplicate('a', 'otra cosa')
+
+
+def test_duplicate_filter_forget():
+    dedup = DuplicateFilter(window=2.0, clock=FakeClock())
+    dedup.is_duplicate('a', 'hola')
+    dedup.forget('a')
+    assert not dedup.is_duplicate('a', 'hola')
+
+
+def test_inflight_limiter_rejects_above_limit_until_release():
+    limiter = InflightLimiter(2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+    assert limiter.inflight == 2
+
+
+def test_truncate_input():
+    assert truncate_input('hola', 10) == 'hola'
+    assert truncate_input('hola mundo', 5) == 'hola'
@@ -0,0 +1,46 @@
+from cache import CompletionCache, from_placeholders, normalize_prompt, to_cacheable, to_placeholders
+
+
+def test_to_placeholders_only_replaces_whole_words():
+    values = {'{{nombre}}': 'Eva'}
+    text = to_placeholders('Hola Eva, tu página web nueva está lista.', values)
+    assert text == 'Hola {{nombre}}, tu página web nueva está lista.'
+    assert from_placeholders(text, {'{{nombre}}': 'Pedro'}) == 'Hola Pedro, tu página web nueva está lista.'
+
+
+def test_reply_with_partial_name_is_not_cacheable():
+    values = {'{{nombre}}': 'Me llamo Juan Pérez', '{{email}}': ''}
+    assert to_cacheable('¡Hola Juan! ¿Me das tu correo?', values) is None
+
+
+def test_reply_with_partial_email_is_not_cacheable():
+    values = {'{{nombre}}': 'Ana', '{{email}}': 'ana.garcia@ejemplo.com'}
+    assert to_cacheable('Gracias, te escribiremos a ana.garcia.', values) is None
+
+
+def test_reply_without_personal_data_is_cacheable():
+    values = {'{{nombre}}': 'Eva', '{{email}}': 'eva@ejemplo.com'}
+    text = to_cacheable('¡Hola Eva! Te escribiremos a eva@ejemplo.com sobre tu web nueva.', values)
+    assert text == '¡Hola {{nombre}}! Te escribiremos a {{email}} sobre tu web nueva.'
+
+
+def test_cache_hit_fills_in_current_user():
+    cache = CompletionCache(max_entries=4, ttl=60)
+    first = {'{{nombre}}': 'Eva', '{{email}}': ''}
+    second = {'{{nombre}}': 'Pedro', '{{email}}': ''}
+    prompt = 'El usuario acaba de dar su nombre: {}.'
+    key = cache.make_key(0, normalize_prompt(prompt.format('Eva'), first))
+    cache.set(key, to_cacheable('¡Hola Eva! Tu web nueva te espera.', first))
+
+    other_key = cache.make_key(0, normalize_prompt(prompt.format('Pedro'), second))
+    assert other_key == key
+    assert from_placeholders(cache.get(other_key), second) == '¡Hola Pedro! Tu web nueva te espera.'
+    assert cache.stats() == {'hits': 1, 'misses': 0, 'size': 1}
+
+
+def test_sqlite_tier_survives_new_instance(tmp_path):
+    db_path = str(tmp_path / 'cache.db')
+    CompletionCache(max_entries=4, ttl=60, db_path=db_path).set('k', 'valor')
+    cache = CompletionCache(max_entries=4, ttl=60, db_path=db_path)
+    assert cache.get('k') == 'valor'
+    assert cache.get('otra') is None
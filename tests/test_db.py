@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import threading
+
+import db
+
+
+def make_writer(tmp_path):
+    db_path = str(tmp_path / 'leads.db')
+    pool = db.ConnectionPool(lambda: sqlite3.connect(db_path, check_same_thread=False))
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE leads (id INTEGER PRIMARY KEY, name TEXT, email TEXT, business_type TEXT, needs TEXT)')
+    writer = db.LeadWriter(pool, spawn=lambda fn: None, event_factory=threading.Event,
+                           spool_path=str(tmp_path / 'spool.jsonl'))
+    return writer, db_path
+
+
+def count(db_path):
+    return sqlite3.connect(db_path).execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+
+
+def lead(name):
+    return {'name': name, 'email': f'{name}@ejemplo.com', 'business_type': 'tienda', 'needs': 'web'}
+
+
+def test_truncated_spool_line_is_quarantined(tmp_path):
+    writer, db_path = make_writer(tmp_path)
+    with open(writer.spool_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(lead('ana')) + '\n')
+        f.write('{"name": "lu')  # escritura interrumpida
+
+    writer.enqueue(lead('pedro'))
+    assert writer.flush() == 2
+    assert count(db_path) == 2
+    assert writer.pending() == 0
+    assert not os.path.exists(writer.spool_path)
+    with open(writer.spool_path + '.bad', encoding='utf-8') as f:
+        assert f.read() == '{"name": "lu\n'
+
+
+def test_spool_after_truncated_line_starts_new_line(tmp_path):
+    def unreachable():
+        raise sqlite3.OperationalError('base de datos caída')
+
+    writer, db_path = make_writer(tmp_path)
+    writer.pool = db.ConnectionPool(unreachable)
+    with open(writer.spool_path, 'w', encoding='utf-8') as f:
+        f.write('{"name": "lu')
+
+    writer.enqueue(lead('ana'))
+    assert writer.flush() == 0
+    with open(writer.spool_path, encoding='utf-8') as f:
+        assert [json.loads(line)['name'] for line in f] == ['ana']
+
+
+class FakeConnection:
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.closed = 0
+        self.commits = 0
+
+    def commit(self):
+        if self.broken:
+            raise ConnectionError('server closed the connection unexpectedly')
+        self.commits += 1
+
+    def rollback(self):
+        if self.broken:
+            raise ConnectionError('connection already closed')
+
+    def close(self):
+        self.closed = 1
+
+
+def test_run_retries_once_when_reused_connection_is_dead():
+    created = []
+
+    def connect():
+        created.append(FakeConnection())
+        return created[-1]
+
+    pool = db.ConnectionPool(connect, is_disconnect=lambda e: isinstance(e, ConnectionError))
+    pool.run(lambda conn: None)
+    created[0].broken = True  # p. ej. reinicio de PostgreSQL mientras estaba ociosa
+
+    assert pool.run(lambda conn: 'ok') == 'ok'
+    assert created[0].closed == 1
+    assert len(created) == 2 and created[1].commits == 1
+
+
+def test_failed_rollback_still_closes_connection():
+    conn = FakeConnection(broken=True)
+    pool = db.ConnectionPool(lambda: conn)
+    try:
+        with pool.connection():
+            pass
+    except ConnectionError:
+        pass
+    assert conn.closed == 1
@@ -0,0 +1,52 @@
+import queue
+import threading
+
+import metrics
+from llm_dispatch import LLMDispatcher
+
+
+def spawn(fn):
+    threading.Thread(target=fn, daemon=True).start()
+
+
+def test_cancel_marks_running_turn_until_it_finishes():
+    dispatcher = LLMDispatcher(spawn, queue.Queue, workers=1)
+    running, release, done = threading.Event(), threading.Event(), threading.Event()
+    seen = []
+
+    def turn():
+        running.set()
+        release.wait(1)
+        seen.append(dispatcher.cancelled('a'))
+        done.set()
+
+    dispatcher.submit('a', turn)
+    assert running.wait(1)
+    dispatcher.cancel('a')
+    release.set()
+    assert done.wait(1)
+    assert seen == [True]
+
+
+def test_cancel_mark_outlives_turn_and_expires():
+    dispatcher = LLMDispatcher(spawn, queue.Queue, workers=1, cancel_ttl=0.05)
+    # Sin turno en curso también se marca: puede quedar una llamada tardía al LLM
+    dispatcher.cancel('b')
+    assert dispatcher.cancelled('b')
+    threading.Event().wait(0.06)
+    assert not dispatcher.cancelled('b')
+    dispatcher.cancel('c')
+    assert list(dispatcher._cancelled) == ['c']
+
+
+def test_queue_wait_is_recorded_when_workers_are_busy():
+    before = metrics.llm_queue_wait._values.get((), [None, 0.0, 0])[1:]
+    dispatcher = LLMDispatcher(spawn, queue.Queue, workers=1)
+    done = threading.Event()
+    dispatcher.submit('a', threading.Event().wait, 0.1)
+    dispatcher.submit('b', done.set)
+    assert done.wait(1)
+    total, count = metrics.llm_queue_wait._values[()][1:]
+    assert count - before[1] == 2
+    # El turno de 'b' esperó a que terminara el de 'a'
+    assert total - before[0] >= 0.1
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from replies import ReplyEngine
+
+
+def spawn(fn):
+    threading.Thread(target=fn, daemon=True).start()
+
+
+def test_trickling_stream_is_cut_at_total_deadline():
+    engine = ReplyEngine(spawn, threading.Event, budgets={0: 0.1}, deadline=0.3)
+    chunks = []
+
+    def trickle(on_chunk):
+        for i in range(40):
+            on_chunk(f'p{i} ')
+            time.sleep(0.05)
+        return 'completa'
+
+    start = time.monotonic()
+    text = engine.reply(0, 'plantilla', trickle, on_chunk=chunks.append)
+    assert time.monotonic() - start < 0.5
+    assert text == ''.join(chunks[:len(text.split())]).strip()
+    assert text.startswith('p0 p1')
+
+
+def test_slow_llm_falls_back_to_template_within_budget():
+    engine = ReplyEngine(spawn, threading.Event, budgets={0: 0.1}, deadline=1.0)
+
+    def slow(on_chunk):
+        time.sleep(0.5)
+        return 'tarde'
+
+    start = time.monotonic()
+    assert engine.reply(0, 'plantilla', slow) == 'plantilla'
+    assert time.monotonic() - start < 0.3
+
+
+def test_late_stream_stops_when_client_disconnects():
+    engine = ReplyEngine(spawn, threading.Event, budgets={0: 0.05}, late_mode='followup', deadline=2.0)
+    gone = threading.Event()
+    sent, late = [], []
+    finished = threading.Event()
+
+    def slow_stream(on_chunk):
+        try:
+            time.sleep(0.1)
+            for i in range(20):
+                on_chunk(f'p{i} ')
+                sent.append(i)
+                time.sleep(0.01)
+            return 'completa'
+        finally:
+            finished.set()
+
+    text = engine.reply(0, 'plantilla', slow_stream, on_chunk=lambda d: None,
+                        on_late=late.append, cancelled=gone.is_set)
+    assert text == 'plantilla'
+    gone.set()
+    assert finished.wait(1)
+    assert sent == [] and late == []
@@ -1,22 +1,49 @@
 #!/usr/bin/env python3
-import sqlite3
+import argparse
+import sys
+from dotenv import load_dotenv
 
-def view_leads():
+# Cargar variables de entorno antes de importar db (DATABASE_URL)
+load_dotenv()
+
+from export import FORMATS, ExportCursor, iter_leads
+
+def view_leads(fmt='dict', since_last=False, state_file='.leads_export_state.json', page_size=1000, out=sys.stdout):
     """
-    Se conecta a la base de datos leads.db y muestra todos los registros
-    de la tabla leads.
+    Muestra o exporta los leads de la base de datos configurada (PostgreSQL
+    si hay DATABASE_URL, si no leads.db) sin cargarlos todos en memoria.
+    Con since_last solo se exportan los leads nuevos desde la última vez.
+    Devuelve el código de salida: 1 si la lectura falló.
     """
     try:
-        with sqlite3.connect('leads.db') as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM leads ORDER BY created_at DESC')
-            leads = cursor.fetchall()
-            print(f"--- Mostrando {len(leads)} lead(s) ---")
+        cursor = ExportCursor(state_file) if since_last else None
+        if cursor:
+            leads = cursor.track(iter_leads(after=cursor.position, page_size=page_size))
+        else:
+            # Sin exportación incremental se mantiene el orden de siempre: los más recientes primero
+            leads = iter_leads(page_size=page_size, descending=(fmt == 'dict'))
+
+        if fmt == 'dict':
+            count = 0
             for lead in leads:
-                print(dict(lead))
-    except sqlite3.Error as e:
-        print(f"Error al leer la base de datos: {e}")
+                print(lead, file=out)
+                count += 1
+            print(f"--- {count} lead(s) mostrados ---", file=out)
+        else:
+            for chunk in FORMATS[fmt](leads):
+                out.write(chunk)
+        if cursor:
+            cursor.save()
+    except Exception as e:
+        print(f"Error al leer la base de datos: {e}", file=sys.stderr)
+        return 1
+    return 0
 
 if __name__ == '__main__':
-    view_leads()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Muestra o exporta los leads guardados.')
+    parser.add_argument('--format', choices=['dict'] + list(FORMATS), default='dict')
+    parser.add_argument('--since-last', action='store_true', help='exportar solo los leads nuevos desde la última exportación')
+    parser.add_argument('--state-file', default='.leads_export_state.json')
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+    sys.exit(view_leads(args.format, args.since_last, args.state_file, args.page_size))
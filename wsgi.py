@@ -1,11 +1,14 @@
+import os
 import eventlet
 import eventlet.wsgi
 from app import app, socketio
 
 def main():
     """Inicia el servidor de la aplicación."""
-    print("Iniciando servidor en http://127.0.0.1:5000")
-    eventlet.wsgi.server(eventlet.listen(('127.0.0.1', 5000)), app)
+    host = os.getenv('HOST', '127.0.0.1')
+    port = int(os.getenv('PORT', '5000'))
+    print(f"Iniciando servidor en http://{host}:{port}")
+    eventlet.wsgi.server(eventlet.listen((host, port)), app)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()